@@ -1,10 +1,17 @@
 import os
 import asyncio
+import functools
+import json
+import shlex
 import signal
+import stat
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import json
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, List, Optional, Tuple
 
+import aiofiles
+import orjson
 from mcp.server.fastmcp import FastMCP
 
 # Initialize the MCP server
@@ -18,6 +25,28 @@ mcp = FastMCP("file-server")
 
 # Set the base directory where we'll read and write files
 BASE_DIR = "/data"  # This will be mapped to your local directory in Docker
+_BASE = Path(BASE_DIR).resolve()
+
+def _safe_resolve(rel: str, follow_symlinks: bool = True) -> Optional[Path]:
+    # Resolve a client path under the base directory, or None if it escapes it.
+    # Path.resolve() stats each component, so callers run this via _run_io.
+    if follow_symlinks:
+        p = (_BASE / rel).resolve()
+    else:
+        # Resolve only the parent so a final symlink is addressed, not its target
+        lexical = Path(os.path.normpath(_BASE / rel))
+        p = lexical.parent.resolve() / lexical.name
+    # Component-wise containment, so /data does not admit /data_evil
+    return p if p.is_relative_to(_BASE) else None
+
+def _dumps(obj: Any) -> str:
+    # Tool results are str; orjson encodes straight to bytes, so decode once
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8")
+    except TypeError:
+        # orjson rejects lone surrogates (e.g. undecodable filenames from scandir);
+        # the stdlib encoder escapes them instead
+        return json.dumps(obj, indent=2)
 
 # --- Configuration helpers ---
 DEFAULT_MAX_LINES = 1000
@@ -29,14 +58,20 @@ def _parse_positive_int(value: Any) -> Optional[int]:
     except Exception:
         return None
 
+@functools.lru_cache(maxsize=8)
+def _load_config_cached(cfg_path: str, mtime_ns: int) -> Any:
+    # Keyed on mtime so an edited config is re-parsed; otherwise a reload costs one stat
+    with open(cfg_path, "rb") as f:
+        return orjson.loads(f.read())
+
 def _load_max_lines_from_config_file() -> Optional[int]:
     # Config path can be overridden via env var; else default alongside server.py
     cfg_path_env = os.getenv("FILE_SERVER_CONFIG_PATH")
     cfg_path = Path(cfg_path_env) if cfg_path_env else Path(__file__).with_name("config.json")
     try:
-        if cfg_path.is_file():
-            with open(cfg_path, "r", encoding="utf-8") as f:
-                cfg = json.load(f)
+        st = os.stat(cfg_path)
+        if stat.S_ISREG(st.st_mode):
+            cfg = _load_config_cached(str(cfg_path), st.st_mtime_ns)
             if isinstance(cfg, dict):
                 # Prefer nested run_command.max_lines, fallback to top-level max_lines
                 rc = cfg.get("run_command")
@@ -69,6 +104,61 @@ def _resolve_max_output_lines() -> int:
 # Resolved at import time
 MAX_OUTPUT_LINES = _resolve_max_output_lines()
 
+# Per-stream byte budget for run_command; a child exceeding it is terminated
+OUTPUT_AVG_LINE_BYTES = 8 * 1024
+MAX_OUTPUT_BYTES = MAX_OUTPUT_LINES * OUTPUT_AVG_LINE_BYTES
+PIPE_READ_CHUNK_BYTES = 64 * 1024
+
+DEFAULT_MAX_READ_BYTES = 10 * 1024 * 1024
+READ_CHUNK_BYTES = 1 << 20
+
+def _resolve_max_read_bytes() -> int:
+    env_val = os.getenv("MAX_READ_BYTES")
+    mb = _parse_positive_int(env_val) if env_val is not None else None
+    return mb if mb is not None else DEFAULT_MAX_READ_BYTES
+
+MAX_READ_BYTES = _resolve_max_read_bytes()
+
+# Dedicated pool for blocking file I/O, kept apart from the loop's default executor
+DEFAULT_FILE_IO_WORKERS = 16
+
+def _resolve_file_io_workers() -> int:
+    env_val = os.getenv("FILE_IO_WORKERS")
+    n = _parse_positive_int(env_val) if env_val is not None else None
+    return n if n is not None else DEFAULT_FILE_IO_WORKERS
+
+FILE_IO_WORKERS = _resolve_file_io_workers()
+_IO_EXEC = ThreadPoolExecutor(max_workers=FILE_IO_WORKERS, thread_name_prefix="fileio")
+
+async def _run_io(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_IO_EXEC, functools.partial(fn, *args, **kwargs))
+
+# list_files stats entries in at most this many worker-thread slices, so slow stats
+# overlap without one large listing flooding the shared file I/O pool
+LIST_FILES_STAT_SLICES = 4
+# Directories smaller than this are stat'ed in a single slice
+LIST_FILES_MIN_SLICE = 512
+
+def _scan_dir(target_dir: str) -> List[os.DirEntry]:
+    with os.scandir(target_dir) as it:
+        return list(it)
+
+def _entry_info(entry: os.DirEntry) -> Dict[str, Any]:
+    # DirEntry caches type info from the directory read; only files need a stat
+    is_dir = entry.is_dir()
+    size = entry.stat().st_size if not is_dir else "-"
+    file_type = "Directory" if is_dir else "File"
+
+    return {
+        "name": entry.name,
+        "type": file_type,
+        "size": size
+    }
+
+def _entries_info(entries: List[os.DirEntry]) -> List[Dict[str, Any]]:
+    return [_entry_info(entry) for entry in entries]
+
 @mcp.tool()
 async def list_files(path: str = "") -> str:
     """List all files in the specified directory.
@@ -76,32 +166,97 @@ async def list_files(path: str = "") -> str:
     Args:
         path: Optional subdirectory path relative to the base directory
     """
-    target_dir = os.path.normpath(os.path.join(BASE_DIR, path))
-    
-    # Security check to prevent directory traversal
-    if not target_dir.startswith(BASE_DIR):
-        return f"Error: Cannot access directories outside of the base directory."
-    
     try:
-        files = os.listdir(target_dir)
-        file_info = []
+        target_dir = await _run_io(_safe_resolve, path)
         
-        for file in files:
-            full_path = os.path.join(target_dir, file)
-            is_dir = os.path.isdir(full_path)
-            size = os.path.getsize(full_path) if not is_dir else "-"
-            file_type = "Directory" if is_dir else "File"
-            
-            file_info.append({
-                "name": file,
-                "type": file_type,
-                "size": size
-            })
+        # Security check to prevent directory traversal
+        if target_dir is None:
+            return f"Error: Cannot access directories outside of the base directory."
         
-        return json.dumps(file_info, indent=2)
+        entries = await _run_io(_scan_dir, target_dir)
+
+        # Stat a few slices concurrently so slow (e.g. network) filesystems overlap,
+        # with one executor hop per slice rather than per entry
+        slices = max(1, min(
+            LIST_FILES_STAT_SLICES,
+            FILE_IO_WORKERS,
+            (len(entries) + LIST_FILES_MIN_SLICE - 1) // LIST_FILES_MIN_SLICE,
+        ))
+        step = max(1, (len(entries) + slices - 1) // slices)
+        chunks = await asyncio.gather(*(
+            _run_io(_entries_info, entries[i:i + step])
+            for i in range(0, len(entries), step)
+        ))
+        file_info = [info for chunk in chunks for info in chunk]
+        return _dumps(file_info)
     except Exception as e:
         return f"Error listing files: {str(e)}"
 
+# Files above this size skip the chunked aiofiles loop (one executor hop per chunk)
+LARGE_READ_BYTES = 1 << 20
+
+def _regular_file_size(path: Path) -> Optional[int]:
+    # One stat for both the is-a-file check and the size
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return st.st_size if stat.S_ISREG(st.st_mode) else None
+
+def _read_large_sync(path: Path, size: int, max_bytes: int) -> Tuple[bytearray, bool]:
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            # Ask the kernel for aggressive readahead on this sequential scan
+            try:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                pass
+        prealloc = min(size, max_bytes)
+        buf = bytearray(prealloc)
+        view = memoryview(buf)
+        filled = 0
+        while filled < prealloc:
+            n = f.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        view.release()
+        del buf[filled:]
+        if filled == prealloc:
+            # The file may have grown since it was stat'ed; pick up the rest up to the cap
+            while filled < max_bytes:
+                chunk = f.read(min(READ_CHUNK_BYTES, max_bytes - filled))
+                if not chunk:
+                    break
+                buf.extend(chunk)
+                filled += len(chunk)
+        truncated = filled >= max_bytes and bool(f.read(1))
+    return buf, truncated
+
+async def _read_envelope(target_file: Path, size: int, max_bytes: int) -> Dict[str, Any]:
+    if size > LARGE_READ_BYTES:
+        # Large files: one worker-thread call into a preallocated buffer
+        buf, truncated = await _run_io(_read_large_sync, target_file, size, max_bytes)
+    else:
+        # Stream in chunks and stop at the cap instead of slurping the whole file
+        buf = bytearray()
+        truncated = False
+        async with aiofiles.open(target_file, 'rb', executor=_IO_EXEC) as f:
+            while len(buf) < max_bytes:
+                chunk = await f.read(min(READ_CHUNK_BYTES, max_bytes - len(buf)))
+                if not chunk:
+                    break
+                buf.extend(chunk)
+            else:
+                truncated = bool(await f.read(1))
+
+    return {
+        "content": buf.decode("utf-8", errors="replace"),
+        "truncated": truncated,
+        "bytes_read": len(buf),
+        "max_bytes": max_bytes,
+    }
+
 @mcp.tool()
 async def read_file(file_path: str) -> str:
     """Read the contents of a file.
@@ -109,23 +264,72 @@ async def read_file(file_path: str) -> str:
     Args:
         file_path: Path to the file relative to the base directory
     """
-    target_file = os.path.normpath(os.path.join(BASE_DIR, file_path))
-    
-    # Security check to prevent directory traversal
-    if not target_file.startswith(BASE_DIR):
-        return f"Error: Cannot access files outside of the base directory."
-    
     try:
-        if not os.path.isfile(target_file):
-            return f"Error: File does not exist or is not a file: {file_path}"
+        target_file = await _run_io(_safe_resolve, file_path)
+        
+        # Security check to prevent directory traversal
+        if target_file is None:
+            return f"Error: Cannot access files outside of the base directory."
         
-        with open(target_file, 'r') as f:
-            content = f.read()
+        size = await _run_io(_regular_file_size, target_file)
+        if size is None:
+            return f"Error: File does not exist or is not a file: {file_path}"
         
-        return content
+        return _dumps(await _read_envelope(target_file, size, MAX_READ_BYTES))
     except Exception as e:
         return f"Error reading file: {str(e)}"
 
+# Cap on files read concurrently per batch_read_files invocation
+BATCH_READ_CONCURRENCY = 16
+# Cap on paths per batch_read_files call, bounding its memory to this many file caps
+BATCH_READ_MAX_FILES = 64
+
+@mcp.tool()
+async def batch_read_files(file_paths: List[str], max_bytes_per_file: int = 1_000_000) -> str:
+    """Read the contents of several files in one call.
+    
+    Args:
+        file_paths: Paths to the files relative to the base directory (at most 64 paths)
+        max_bytes_per_file: Maximum bytes to read from each file; a positive integer, further capped by the server's MAX_READ_BYTES setting (default 10 MiB)
+    """
+    if len(file_paths) > BATCH_READ_MAX_FILES:
+        return f"Error: Cannot read more than {BATCH_READ_MAX_FILES} files per call."
+    max_bytes = _parse_positive_int(max_bytes_per_file)
+    if max_bytes is None:
+        return f"Error: max_bytes_per_file must be a positive integer."
+    max_bytes = min(max_bytes, MAX_READ_BYTES)
+    sem = asyncio.Semaphore(BATCH_READ_CONCURRENCY)
+
+    async def _read_one(file_path: str) -> Dict[str, Any]:
+        async with sem:
+            try:
+                target_file = await _run_io(_safe_resolve, file_path)
+                
+                # Security check to prevent directory traversal
+                if target_file is None:
+                    return {"error": "Cannot access files outside of the base directory."}
+                
+                size = await _run_io(_regular_file_size, target_file)
+                if size is None:
+                    return {"error": "File does not exist or is not a file"}
+                return await _read_envelope(target_file, size, max_bytes)
+            except Exception as e:
+                return {"error": f"Error reading file: {str(e)}"}
+
+    results = await asyncio.gather(*(_read_one(p) for p in file_paths))
+    return _dumps(dict(zip(file_paths, results)))
+
+def _write_sync(path: Path, data: bytes) -> None:
+    # Unbuffered write of the whole blob; loop only if the kernel writes short
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
+
 @mcp.tool()
 async def write_file(file_path: str, content: str) -> str:
     """Write content to a file.
@@ -134,23 +338,32 @@ async def write_file(file_path: str, content: str) -> str:
         file_path: Path to the file relative to the base directory
         content: Content to write to the file
     """
-    target_file = os.path.normpath(os.path.join(BASE_DIR, file_path))
-    
-    # Security check to prevent directory traversal
-    if not target_file.startswith(BASE_DIR):
-        return f"Error: Cannot access files outside of the base directory."
-    
     try:
+        target_file = await _run_io(_safe_resolve, file_path)
+        
+        # Security check to prevent directory traversal
+        if target_file is None:
+            return f"Error: Cannot access files outside of the base directory."
+        
         # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(target_file), exist_ok=True)
+        await _run_io(os.makedirs, target_file.parent, exist_ok=True)
         
-        with open(target_file, 'w') as f:
-            f.write(content)
+        await _run_io(_write_sync, target_file, content.encode("utf-8"))
         
         return f"Successfully wrote to {file_path}"
     except Exception as e:
         return f"Error writing to file: {str(e)}"
 
+def _delete_sync(path: Path) -> bool:
+    # Optimistically unlink; only directories pay for a second syscall.
+    # Returns True if a directory was removed.
+    try:
+        os.remove(path)
+        return False
+    except IsADirectoryError:
+        os.rmdir(path)
+        return True
+
 @mcp.tool()
 async def delete_file(file_path: str) -> str:
     """Delete a file.
@@ -158,25 +371,145 @@ async def delete_file(file_path: str) -> str:
     Args:
         file_path: Path to the file relative to the base directory
     """
-    target_file = os.path.normpath(os.path.join(BASE_DIR, file_path))
-    
-    # Security check to prevent directory traversal
-    if not target_file.startswith(BASE_DIR):
-        return f"Error: Cannot access files outside of the base directory."
-    
     try:
-        if not os.path.exists(target_file):
-            return f"Error: File does not exist: {file_path}"
+        target_file = await _run_io(_safe_resolve, file_path, follow_symlinks=False)
+        
+        # Security check to prevent directory traversal
+        if target_file is None:
+            return f"Error: Cannot access files outside of the base directory."
         
-        if os.path.isdir(target_file):
-            os.rmdir(target_file)
+        if await _run_io(_delete_sync, target_file):
             return f"Successfully deleted directory: {file_path}"
-        else:
-            os.remove(target_file)
-            return f"Successfully deleted file: {file_path}"
+        return f"Successfully deleted file: {file_path}"
+    except (FileNotFoundError, NotADirectoryError):
+        return f"Error: File does not exist: {file_path}"
     except Exception as e:
         return f"Error deleting file: {str(e)}"
 
+def _truncate_bytes_lines(data: Optional[bytes], max_lines: int) -> Tuple[bytes, bool]:
+    # Keep at most max_lines lines, scanning only as far as the cut-off
+    if not data:
+        return b"", False
+    idx = -1
+    for _ in range(max_lines):
+        idx = data.find(b"\n", idx + 1)
+        if idx == -1:
+            return data, False
+    if idx >= len(data) - 1:
+        return data, False
+    return data[:idx], True
+
+DEFAULT_COMMAND_TIMEOUT = 60.0
+# Time a command being stopped (timeout or output cap) gets after SIGTERM before SIGKILL
+TERMINATE_GRACE_SECONDS = 0.5
+
+# Pre-rendered error response; only the JSON-encoded cwd is substituted per call
+_CWD_ERROR_TEMPLATE = _dumps({
+    "error": "Cannot use cwd outside of the base directory",
+    "cwd": None,
+}).replace("%", "%%").replace('"cwd": null', '"cwd": %s')
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _resolve_timeout(timeout: Any, timeout_ms: Any) -> Optional[float]:
+    # `timeout` (seconds) wins over `timeout_ms`; values <= 0 disable the timeout
+    if timeout is None and timeout_ms is None:
+        return DEFAULT_COMMAND_TIMEOUT
+    secs = _to_float(timeout)
+    if secs is None:
+        ms = _to_float(timeout_ms)
+        secs = (ms / 1000.0) if ms is not None else None
+    return secs if (secs is not None and secs > 0) else None
+
+# Characters that need /bin/sh to interpret; commands without them are exec'd directly
+_SHELL_META = frozenset("|&;<>()$`\\\"'*?[]{}#~=%!\n\t")
+
+async def _spawn_command(command: str, **kwargs: Any) -> asyncio.subprocess.Process:
+    # Skip the intermediate shell for plain "program arg ..." commands
+    if not any(c in _SHELL_META for c in command):
+        argv = shlex.split(command)
+        if argv:
+            try:
+                return await asyncio.create_subprocess_exec(*argv, **kwargs)
+            except OSError:
+                # Not a runnable program (e.g. a shell builtin); let the shell handle it
+                pass
+    return await asyncio.create_subprocess_shell(command, **kwargs)
+
+def _signal_process_group(proc: asyncio.subprocess.Process, sig: int) -> None:
+    # Signal the entire process group so children are reached as well
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, sig)
+        else:
+            proc.send_signal(sig)
+    except Exception:
+        # Fallback to signalling the process itself
+        try:
+            proc.send_signal(sig)
+        except Exception:
+            pass
+
+async def _terminate_process_group(
+    proc: asyncio.subprocess.Process,
+    finished: "asyncio.Future[Any]",
+) -> None:
+    # SIGTERM first; SIGKILL the group if `finished` (exit + pipe EOF) is not done in time
+    _signal_process_group(proc, signal.SIGTERM)
+    await asyncio.wait({finished}, timeout=TERMINATE_GRACE_SECONDS)
+    if not finished.done():
+        _signal_process_group(proc, signal.SIGKILL)
+
+async def _read_capped(
+    stream: asyncio.StreamReader,
+    cap_bytes: int,
+    cap_hit: asyncio.Event,
+) -> Tuple[bytes, bool]:
+    # Buffer at most cap_bytes; past that, flag the cap and discard the rest
+    buf = bytearray()
+    capped = False
+    while True:
+        chunk = await stream.read(PIPE_READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        if capped:
+            # Keep draining so the child never blocks on a full pipe
+            continue
+        buf.extend(chunk)
+        if len(buf) >= cap_bytes:
+            del buf[cap_bytes:]
+            capped = True
+            cap_hit.set()
+    return bytes(buf), capped
+
+async def _discard(stream: asyncio.StreamReader) -> None:
+    # Drain a pipe to EOF without keeping any of it
+    while await stream.read(PIPE_READ_CHUNK_BYTES):
+        pass
+
+async def _stop_on_cap(
+    proc: asyncio.subprocess.Process,
+    cap_hit: asyncio.Event,
+    finished: "asyncio.Future[Any]",
+) -> None:
+    # Stop a command as soon as either stream overflows its byte budget
+    await cap_hit.wait()
+    await _terminate_process_group(proc, finished)
+
+async def _feed_stdin(stream: asyncio.StreamWriter, data: bytes) -> None:
+    try:
+        stream.write(data)
+        await stream.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # The child exited without reading all of its input
+        pass
+    finally:
+        stream.close()
+
 @mcp.tool()
 async def run_command(
     command: str,
@@ -197,71 +530,60 @@ async def run_command(
     Notes:
         - Commands run inside the container using the POSIX shell and are constrained to the base directory.
         - Redirection and pipes are supported because commands run through a shell.
+        - Simple commands with no shell syntax (e.g. 'ls -al') are executed directly, skipping the shell.
     """
 
-    # Resolve working directory under BASE_DIR
-    working_dir = BASE_DIR
-    if cwd:
-        candidate = os.path.normpath(os.path.join(BASE_DIR, cwd))
-        if not candidate.startswith(BASE_DIR):
-            return json.dumps({
-                "error": "Cannot use cwd outside of the base directory",
-                "cwd": cwd,
-            }, indent=2)
-        working_dir = candidate
-
     # Determine effective timeout in seconds
-    def _to_float(value: Any) -> Optional[float]:
-        try:
-            return float(value) if value is not None else None
-        except (TypeError, ValueError):
-            return None
-
-    timeout_secs: Optional[float]
-    if timeout is not None or timeout_ms is not None:
-        secs = _to_float(timeout)
-        if secs is None:
-            ms = _to_float(timeout_ms)
-            secs = (ms / 1000.0) if ms is not None else None
-        timeout_secs = secs if (secs is not None and secs > 0) else None
-    else:
-        timeout_secs = 60.0
+    timeout_secs = _resolve_timeout(timeout, timeout_ms)
 
+    working_dir = str(_BASE)
     try:
-        proc = await asyncio.create_subprocess_shell(
+        # Resolve working directory under BASE_DIR
+        if cwd:
+            candidate = await _run_io(_safe_resolve, cwd)
+            if candidate is None:
+                return _CWD_ERROR_TEMPLATE % _dumps(cwd)
+            working_dir = str(candidate)
+
+        proc = await _spawn_command(
             command,
             stdin=asyncio.subprocess.PIPE if stdin is not None else None,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
             cwd=working_dir,
             start_new_session=True,  # ensure a new process group for robust termination
-            env=os.environ.copy(),
+            env=None,  # inherit the server's environment without copying it per call
         )
 
+        # Read both pipes incrementally so a runaway command cannot exhaust memory
+        stdin_tasks = [_feed_stdin(proc.stdin, stdin.encode("utf-8"))] if stdin is not None else []
+        cap_hit = asyncio.Event()
+        io_done = asyncio.gather(
+            _read_capped(proc.stdout, MAX_OUTPUT_BYTES, cap_hit),
+            _read_capped(proc.stderr, MAX_OUTPUT_BYTES, cap_hit),
+            proc.wait(),
+            *stdin_tasks,
+        )
+        cap_watch = asyncio.ensure_future(_stop_on_cap(proc, cap_hit, io_done))
         try:
-            stdout_bytes, stderr_bytes = await asyncio.wait_for(
-                proc.communicate(input=stdin.encode("utf-8") if stdin is not None else None),
+            (stdout_bytes, stdout_capped), (stderr_bytes, stderr_capped), *_ = await asyncio.wait_for(
+                io_done,
                 timeout=timeout_secs,
             )
         except asyncio.TimeoutError:
-            # Kill the entire process group to ensure children are terminated
-            try:
-                if hasattr(os, "killpg"):
-                    os.killpg(proc.pid, signal.SIGKILL)
-                else:
-                    proc.kill()
-            except Exception:
-                # Fallback to killing the process itself
-                try:
-                    proc.kill()
-                except Exception:
-                    pass
+            # Discard output while the process group is asked to exit, then killed if it lingers
+            drained = asyncio.gather(
+                _discard(proc.stdout),
+                _discard(proc.stderr),
+                proc.wait(),
+            )
+            await _terminate_process_group(proc, drained)
             # Ensure process is cleaned up
             try:
-                await proc.communicate()
+                await drained
             except Exception:
                 pass
-            return json.dumps({
+            return _dumps({
                 "stdout": "",
                 "stderr": "Command timed out",
                 "exit_code": None,
@@ -273,26 +595,20 @@ async def run_command(
                 "stdout_truncated": False,
                 "stderr_truncated": False,
                 "max_lines": MAX_OUTPUT_LINES,
-            }, indent=2)
-
-        stdout = stdout_bytes.decode("utf-8", errors="replace") if stdout_bytes else ""
-        stderr = stderr_bytes.decode("utf-8", errors="replace") if stderr_bytes else ""
-
-        # Truncate outputs to a maximum number of lines
-        def _truncate_lines(text: str, max_lines: int) -> (str, bool):
-            if not text:
-                return text, False
-            lines = text.split("\n")
-            if len(lines) <= max_lines:
-                return text, False
-            truncated_text = "\n".join(lines[:max_lines])
-            return truncated_text, True
-
-        stdout_truncated_text, stdout_truncated = _truncate_lines(stdout, MAX_OUTPUT_LINES)
-        stderr_truncated_text, stderr_truncated = _truncate_lines(stderr, MAX_OUTPUT_LINES)
+            })
+        finally:
+            cap_watch.cancel()
+
+        # Truncate at the byte level first so only the kept slice gets decoded
+        stdout_head, stdout_truncated = _truncate_bytes_lines(stdout_bytes, MAX_OUTPUT_LINES)
+        stderr_head, stderr_truncated = _truncate_bytes_lines(stderr_bytes, MAX_OUTPUT_LINES)
+        stdout_truncated = stdout_truncated or stdout_capped
+        stderr_truncated = stderr_truncated or stderr_capped
+        stdout_truncated_text = stdout_head.decode("utf-8", errors="replace")
+        stderr_truncated_text = stderr_head.decode("utf-8", errors="replace")
         any_truncated = stdout_truncated or stderr_truncated
 
-        return json.dumps({
+        return _dumps({
             "stdout": stdout_truncated_text,
             "stderr": stderr_truncated_text,
             "exit_code": proc.returncode,
@@ -304,9 +620,9 @@ async def run_command(
             "stdout_truncated": stdout_truncated,
             "stderr_truncated": stderr_truncated,
             "max_lines": MAX_OUTPUT_LINES,
-        }, indent=2)
+        })
     except Exception as e:
-        return json.dumps({
+        return _dumps({
             "error": f"Error running command: {str(e)}",
             "cwd": working_dir,
             "command": command,
@@ -314,8 +630,19 @@ async def run_command(
             "stdout_truncated": False,
             "stderr_truncated": False,
             "max_lines": MAX_OUTPUT_LINES,
-        }, indent=2)
+        })
+
+def _install_uvloop() -> None:
+    # Optional dependency: use the libuv-backed loop when available
+    if sys.platform == "win32":
+        return
+    try:
+        import uvloop
+    except ImportError:
+        return
+    uvloop.install()
 
 if __name__ == "__main__":
+    _install_uvloop()
     # Initialize and run the server with stdio transport
     mcp.run(transport='stdio')